@@ -1,17 +1,81 @@
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Tuple
+from contextlib import asynccontextmanager, suppress
 import uvicorn
-import json
+import aiosqlite
+import asyncio
+import orjson
+import logging
+import mmap
 import os
+import time
 from datetime import datetime
+from sortedcontainers import SortedList
 
 from api.link_funcs import save_link
 
-links_db = "V1/db/links.json"
-votes_db = "V1/db/votes.json"
-app = FastAPI(title="World Wide Linky's API")
+links_db = "V1/db/links.db"
+# Old JSON stores, imported into links_db the first time it is created
+links_json = "V1/db/links.json"
+votes_json = "V1/db/votes.json"
+
+# Shared connection, opened once at startup and reused across requests
+db: Optional[aiosqlite.Connection] = None
+# Created in lifespan so they belong to the event loop that serves requests
+write_lock: Optional[asyncio.Lock] = None
+
+# Serialized GET /api/links body, rebuilt only after a write bumps links_version
+links_version = 0
+links_cache: Optional[Tuple[int, bytes]] = None
+
+# Vote writes waiting for the background flusher, applied in order
+pending_writes: List[Tuple[str, tuple]] = []
+writes_pending: Optional[asyncio.Event] = None
+# How long the flusher waits after the first queued write to batch later ones
+flush_delay = 0.1
+
+# PRAGMA data_version when the in-memory state was last loaded; it changes
+# whenever another connection (i.e. another worker process) commits
+seen_data_version: Optional[int] = None
+
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global db, write_lock, writes_pending, seen_data_version
+    # Ensure the db directory exists
+    os.makedirs(os.path.dirname(links_db), exist_ok=True)
+    
+    write_lock = asyncio.Lock()
+    writes_pending = asyncio.Event()
+    if pending_writes:
+        writes_pending.set()
+    db = await aiosqlite.connect(links_db, isolation_level=None)
+    try:
+        db.row_factory = aiosqlite.Row
+        await configure_db(db, links_db)
+        await init_db(db)
+        await import_legacy_json(db, links_json, votes_json)
+        seen_data_version = None
+        await sync_with_db()
+        
+        flusher_task = asyncio.create_task(flusher(db))
+        try:
+            yield
+        finally:
+            # Let a flush that is already running roll back and requeue its
+            # batch before the final flush picks everything up
+            flusher_task.cancel()
+            with suppress(asyncio.CancelledError):
+                await flusher_task
+            await flush_writes(db)
+    finally:
+        # Always release the file handles and checkpoint the WAL
+        await db.close()
+
+app = FastAPI(title="World Wide Linky's API", lifespan=lifespan)
 
 # Configure CORS to allow requests from the frontend
 app.add_middleware(
@@ -39,77 +103,224 @@ class Vote(BaseModel):
     link_id: int
     vote_type: str  # "like" or "dislike"
 
-def read_links(db_path: str) -> List[Link]:
-    """Read links from the JSON file."""
-    if not os.path.exists(db_path):
-        return []
-    
-    with open(db_path, 'r') as f:
-        links_data = json.load(f)
-    
-    # Convert the data to Link objects
-    links = []
-    for item in links_data:
-        links.append(Link(
-            id=item.get("id"),
-            url=item.get("url", ""),
-            title=item.get("title", ""),
-            description=item.get("description", ""),
-            likes=item.get("likes", 0),
-            dislikes=item.get("dislikes", 0)
-        ))
-    
-    return links
-
-def write_links(db_path: str, links: List[Link]):
-    """Write links to the JSON file."""
-    links_data = []
-    for link in links:
-        links_data.append({
-            "id": link.id,
-            "url": link.url,
-            "title": link.title,
-            "description": link.description,
-            "likes": link.likes,
-            "dislikes": link.dislikes
-        })
-    
-    with open(db_path, 'w') as f:
-        json.dump(links_data, f, indent=2)
+# In-memory index of every link, loaded at startup and updated after each write
+links_by_id: Dict[int, Link] = {}
+# The same links ordered by score (likes - dislikes) descending, ties by ID
+sorted_links = SortedList(key=lambda link: (link.dislikes - link.likes, link.id))
+
+async def configure_db(db: aiosqlite.Connection, db_path: str):
+    """Set connection pragmas; WAL lets readers and the writer run concurrently."""
+    if not db_path.endswith(":memory:"):
+        await db.execute("PRAGMA journal_mode=WAL")
+        await db.execute("PRAGMA synchronous=NORMAL")
+        await db.execute("PRAGMA temp_store=MEMORY")
+        await db.execute("PRAGMA mmap_size=268435456")
+
+@asynccontextmanager
+async def transaction(db: aiosqlite.Connection, mode: str = "IMMEDIATE"):
+    """Run the enclosed statements in one transaction; the caller holds write_lock."""
+    await db.execute(f"BEGIN {mode}")
+    try:
+        yield db
+    except BaseException:
+        await db.execute("ROLLBACK")
+        raise
+    await db.execute("COMMIT")
+
+@asynccontextmanager
+async def write_transaction(db: aiosqlite.Connection):
+    """Run the enclosed statements in one short BEGIN IMMEDIATE transaction."""
+    # The connection is shared, so only one coroutine may hold a transaction
+    async with write_lock:
+        async with transaction(db):
+            yield db
+
+def queue_write(sql: str, params: tuple):
+    """Queue a write for the background flusher."""
+    pending_writes.append((sql, params))
+    writes_pending.set()
+
+async def apply_pending_writes(db: aiosqlite.Connection):
+    """Apply every queued write in a single transaction; the caller holds write_lock."""
+    if not pending_writes:
+        return
+    batch = pending_writes[:]
+    pending_writes.clear()
+    try:
+        async with transaction(db):
+            for sql, params in batch:
+                await db.execute(sql, params)
+    except BaseException:
+        # Put the batch back so the next flush retries it
+        pending_writes[:0] = batch
+        raise
+
+async def flush_writes(db: aiosqlite.Connection):
+    """Apply every queued write in a single transaction."""
+    async with write_lock:
+        await apply_pending_writes(db)
 
-def read_votes(db_path: str) -> List[Dict]:
-    """Read votes from the JSON file."""
-    if not os.path.exists(db_path):
+async def flusher(db: aiosqlite.Connection):
+    """Background task that coalesces bursts of queued writes."""
+    while True:
+        await writes_pending.wait()
+        await asyncio.sleep(flush_delay)
+        writes_pending.clear()
+        try:
+            await flush_writes(db)
+        except Exception:
+            logger.exception("Failed to flush %d queued writes", len(pending_writes))
+            writes_pending.set()
+
+def to_timestamp(value) -> float:
+    """Convert a vote timestamp (ISO string or epoch seconds) to epoch seconds."""
+    if isinstance(value, str):
+        return datetime.fromisoformat(value).timestamp()
+    return float(value)
+
+async def init_db(db: aiosqlite.Connection):
+    """Create the tables and indexes if they don't exist yet."""
+    await db.executescript("""
+        CREATE TABLE IF NOT EXISTS links (
+            id INTEGER PRIMARY KEY,
+            url TEXT NOT NULL,
+            title TEXT NOT NULL,
+            description TEXT NOT NULL,
+            likes INTEGER NOT NULL DEFAULT 0,
+            dislikes INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS votes (
+            link_id INTEGER NOT NULL REFERENCES links(id),
+            vote_type TEXT NOT NULL,
+            timestamp REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS votes_link_id_timestamp
+            ON votes(link_id, timestamp DESC);
+    """)
+
+def read_json_file(path: str) -> List[Dict]:
+    """Read a JSON array from a file, treating a missing file as empty."""
+    try:
+        with open(path, 'rb') as f:
+            # mmap cannot map an empty file, so check the size first
+            if os.fstat(f.fileno()).st_size == 0:
+                return []
+            # Parse straight from the page cache instead of copying the file first
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as buf:
+                return orjson.loads(buf)
+    except FileNotFoundError:
         return []
+
+async def import_legacy_json(db: aiosqlite.Connection, links_path: str, votes_path: str):
+    """Import the old JSON stores into an empty database."""
+    links_data = read_json_file(links_path)
+    votes_data = read_json_file(votes_path)
     
-    with open(db_path, 'r') as f:
-        return json.load(f)
+    async with write_transaction(db):
+        # Every worker runs this at startup; only the first one imports
+        async with db.execute("SELECT 1 FROM links LIMIT 1") as cur:
+            if await cur.fetchone():
+                return
+        
+        await db.executemany(
+            "INSERT INTO links(id, url, title, description, likes, dislikes) VALUES(?, ?, ?, ?, ?, ?)",
+            [(item.get("id"),
+              item.get("url", ""),
+              item.get("title", ""),
+              item.get("description", ""),
+              item.get("likes", 0),
+              item.get("dislikes", 0)) for item in links_data]
+        )
+        await db.executemany(
+            "INSERT INTO votes(link_id, vote_type, timestamp) VALUES(?, ?, ?)",
+            [(v["link_id"], v["vote_type"], to_timestamp(v["timestamp"])) for v in votes_data]
+        )
+
+def invalidate_links_cache():
+    """Mark the cached GET /api/links body as stale."""
+    global links_version
+    links_version += 1
 
-def write_votes(db_path: str, votes: List[Dict]):
-    """Write votes to the JSON file."""
-    with open(db_path, 'w') as f:
-        json.dump(votes, f, indent=2)
+def row_to_link(row: aiosqlite.Row) -> Link:
+    """Convert a links table row to a Link object."""
+    # Rows were validated when they were inserted, so skip re-validating them
+    return Link.model_construct(
+        id=row["id"],
+        url=row["url"],
+        title=row["title"],
+        description=row["description"],
+        likes=row["likes"],
+        dislikes=row["dislikes"]
+    )
+
+async def read_links(db: aiosqlite.Connection) -> List[Link]:
+    """Read links from the database."""
+    async with db.execute(
+        "SELECT id, url, title, description, likes, dislikes FROM links"
+    ) as cur:
+        rows = await cur.fetchall()
+    return [row_to_link(row) for row in rows]
+
+def load_state(links: List[Link]):
+    """Replace the in-memory indexes with freshly read data."""
+    links_by_id.clear()
+    links_by_id.update({link.id: link for link in links})
+    sorted_links.clear()
+    sorted_links.update(links)
+    invalidate_links_cache()
+
+async def read_data_version(db: aiosqlite.Connection) -> int:
+    """Return PRAGMA data_version, which changes when another connection commits."""
+    async with db.execute("PRAGMA data_version") as cur:
+        return (await cur.fetchone())[0]
+
+async def sync_with_db():
+    """Reload the in-memory state if another worker has committed changes."""
+    global seen_data_version
+    if await read_data_version(db) == seen_data_version:
+        return
+    
+    # Hold write_lock so neither the flusher nor process_link can commit
+    # between the reload reading the database and replacing the state
+    async with write_lock:
+        # Requests queued on the lock behind a reload have nothing left to do
+        data_version = await read_data_version(db)
+        if data_version == seen_data_version:
+            return
+        
+        # Push our own queued writes first so the reload includes them
+        await apply_pending_writes(db)
+        links = await read_links(db)
+        if pending_writes:
+            # Votes arrived while reading; keep the current state and retry next request
+            return
+        load_state(links)
+        seen_data_version = data_version
 
-def get_next_link_id(links: List[Link]) -> int:
-    """Get the next available ID for a new link."""
-    if not links:
-        return 1
-    return max(link.id for link in links) + 1
+def rescore_link(link: Link, likes: int, dislikes: int):
+    """Update a link's vote counts and keep sorted_links in order."""
+    sorted_links.remove(link)
+    link.likes = likes
+    link.dislikes = dislikes
+    sorted_links.add(link)
 
-@app.get("/api/links", response_model=List[Link])
+@app.get("/api/links", response_model=List[Link], dependencies=[Depends(sync_with_db)])
 async def get_links():
     """
     Retrieve all saved links from the database, sorted by likes - dislikes.
     """
+    global links_cache
     try:
-        links = read_links(links_db)
-        # Sort links by score (likes - dislikes) in descending order
-        sorted_links = sorted(links, key=lambda x: (x.likes - x.dislikes), reverse=True)
-        return sorted_links
+        # A cache hit skips building and encoding the body; sync_with_db still
+        # makes one PRAGMA data_version round trip per request
+        if links_cache is None or links_cache[0] != links_version:
+            version = links_version
+            links_cache = (version, orjson.dumps([dict(link) for link in sorted_links]))
+        return Response(content=links_cache[1], media_type="application/json")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to retrieve links: {str(e)}")
 
-@app.post("/api/process-link")
+@app.post("/api/process-link", dependencies=[Depends(sync_with_db)])
 async def process_link(data: LinkData):
     """
     Process a link with title and description.
@@ -131,47 +342,48 @@ async def process_link(data: LinkData):
         title = data.title if data.title else "No Title Provided"
         description = data.description if data.description else "No Description Provided"
         
-        save_link(links_db, url, title, description)
+        # Keep write_lock until the link is indexed, so a reload from
+        # sync_with_db cannot add the same row in between
+        async with write_lock:
+            async with transaction(db):
+                link_id = await save_link(db, url, title, description)
+            link = Link(id=link_id, url=url, title=title, description=description)
+            links_by_id[link_id] = link
+            sorted_links.add(link)
+        invalidate_links_cache()
         
         return result
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Processing failed: {str(e)}")
 
-@app.post("/api/vote")
+@app.post("/api/vote", dependencies=[Depends(sync_with_db)])
 async def add_vote(vote: Vote):
     """
     Add a like or dislike vote to a link.
     """
     try:
-        # Read current links and votes
-        links = read_links(links_db)
-        votes = read_votes(votes_db)
-        
         # Find the link by ID
-        link = next((l for l in links if l.id == vote.link_id), None)
+        link = links_by_id.get(vote.link_id)
         if not link:
             raise HTTPException(status_code=404, detail="Link not found")
         
         # Update vote counts
         if vote.vote_type == "like":
-            link.likes += 1
+            rescore_link(link, link.likes + 1, link.dislikes)
+            queue_write("UPDATE links SET likes = likes + 1 WHERE id = ?", (vote.link_id,))
         elif vote.vote_type == "dislike":
-            link.dislikes += 1
+            rescore_link(link, link.likes, link.dislikes + 1)
+            queue_write("UPDATE links SET dislikes = dislikes + 1 WHERE id = ?", (vote.link_id,))
         else:
             raise HTTPException(status_code=400, detail="Invalid vote type")
         
-        # Save the updated link
-        write_links(links_db, links)
-        
         # Record the vote
-        new_vote = {
-            "link_id": vote.link_id,
-            "vote_type": vote.vote_type,
-            "timestamp": datetime.now().isoformat()
-        }
-        votes.append(new_vote)
-        write_votes(votes_db, votes)
+        queue_write(
+            "INSERT INTO votes(link_id, vote_type, timestamp) VALUES(?, ?, ?)",
+            (vote.link_id, vote.vote_type, time.time())
+        )
+        invalidate_links_cache()
         
         return {"status": "success", "message": f"Vote {vote.vote_type}d successfully"}
     
@@ -180,44 +392,47 @@ async def add_vote(vote: Vote):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to add vote: {str(e)}")
 
-@app.delete("/api/vote/{link_id}")
+@app.delete("/api/vote/{link_id}", dependencies=[Depends(sync_with_db)])
 async def remove_vote(link_id: int):
     """
     Remove a vote from a link.
     """
     try:
-        # Read current links and votes
-        links = read_links(links_db)
-        votes = read_votes(votes_db)
-        
         # Find the link by ID
-        link = next((l for l in links if l.id == link_id), None)
+        link = links_by_id.get(link_id)
         if not link:
             raise HTTPException(status_code=404, detail="Link not found")
         
-        # Find the most recent vote for this link
-        # In a real app, you would track votes per user
-        # For simplicity, we'll just remove the most recent vote
-        link_votes = [v for v in votes if v["link_id"] == link_id]
-        if not link_votes:
-            raise HTTPException(status_code=404, detail="No votes found for this link")
-        
-        # Sort by timestamp to get the most recent
-        link_votes.sort(key=lambda x: x["timestamp"], reverse=True)
-        recent_vote = link_votes[0]
-        
-        # Update vote counts
-        if recent_vote["vote_type"] == "like":
-            link.likes = max(0, link.likes - 1)
-        elif recent_vote["vote_type"] == "dislike":
-            link.dislikes = max(0, link.dislikes - 1)
-        
-        # Save the updated link
-        write_links(links_db, links)
-        
-        # Remove the vote record
-        votes = [v for v in votes if not (v["link_id"] == link_id and v["timestamp"] == recent_vote["timestamp"])]
-        write_votes(votes_db, votes)
+        # Removals run straight away instead of through the flusher: the
+        # decrement must only happen if this worker's DELETE removed the row
+        async with write_lock:
+            # Flush queued votes first so the most recent one is in the table
+            await apply_pending_writes(db)
+            async with transaction(db):
+                # Find and remove the most recent vote for this link
+                # In a real app, you would track votes per user
+                # For simplicity, we'll just remove the most recent vote
+                async with db.execute(
+                    "DELETE FROM votes WHERE rowid = ("
+                    "SELECT rowid FROM votes WHERE link_id = ? ORDER BY timestamp DESC LIMIT 1) "
+                    "RETURNING vote_type",
+                    (link_id,)
+                ) as cur:
+                    recent_vote = await cur.fetchone()
+                if not recent_vote:
+                    raise HTTPException(status_code=404, detail="No votes found for this link")
+                
+                # Update vote counts
+                if recent_vote["vote_type"] == "like":
+                    sql = "UPDATE links SET likes = MAX(0, likes - 1) WHERE id = ? RETURNING likes, dislikes"
+                else:
+                    sql = "UPDATE links SET dislikes = MAX(0, dislikes - 1) WHERE id = ? RETURNING likes, dislikes"
+                async with db.execute(sql, (link_id,)) as cur:
+                    counts = await cur.fetchone()
+            
+            # The counts come from the database, so they include other workers' votes
+            rescore_link(link, counts["likes"], counts["dislikes"])
+        invalidate_links_cache()
         
         return {"status": "success", "message": "Vote removed successfully"}
     
@@ -227,17 +442,12 @@ async def remove_vote(link_id: int):
         raise HTTPException(status_code=500, detail=f"Failed to remove vote: {str(e)}")
 
 if __name__ == "__main__":
-    # Ensure the db directory exists
-    os.makedirs(os.path.dirname(links_db), exist_ok=True)
-    
-    # Initialize votes file if it doesn't exist
-    if not os.path.exists(votes_db):
-        with open(votes_db, 'w') as f:
-            json.dump([], f)
-    
+    # Development server; production runs uvicorn with WEB_CONCURRENCY workers (see render.yaml)
     uvicorn.run(
         "main:app",
         host="localhost",
         port=8000,
+        loop="uvloop",
+        http="httptools",
         reload=True
-    )
\ No newline at end of file
+    )